@@ -1,12 +1,39 @@
+import threading
+import time
+
+from cachetools import TLRUCache
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_admin import auth as firebase_auth
 
 auth_scheme = HTTPBearer()
 
+TOKEN_CACHE_TTL = 60  # seconds
+
+
+def _token_ttu(_token, decoded, now):
+    # never serve a token past its own expiry
+    return min(now + TOKEN_CACHE_TTL, decoded.get("exp", now))
+
+
+# raw JWT -> decoded claims; a JWT is self-contained, so it is a safe key
+_token_cache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+_token_lock = threading.Lock()
+
+
+def _verify(token: str):
+    with _token_lock:
+        decoded = _token_cache.get(token)
+    if decoded is None:
+        decoded = firebase_auth.verify_id_token(token)
+        with _token_lock:
+            _token_cache[token] = decoded
+    return decoded
+
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(auth_scheme)):
     try:
-        decoded_token = firebase_auth.verify_id_token(credentials.credentials)
+        decoded_token = _verify(credentials.credentials)
         return decoded_token  # includes uid, email, etc.
     except Exception:
         raise HTTPException(status_code=401, detail="Unauthorized")
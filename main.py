@@ -1,19 +1,41 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from firebase_admin import credentials, initialize_app
+from fastapi.responses import ORJSONResponse
+from firebase_admin import credentials, get_app, initialize_app
 import os
 from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
 
 
-# Load environment variables
+# Load environment variables (before the routers read any at import time)
 load_dotenv()
 
-# Initialize Firebase Admin
-cred = credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-initialize_app(cred)
+from routers import data  # noqa: E402
 
-# Create FastAPI app
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize Firebase Admin once per process
+    try:
+        get_app()
+    except ValueError:
+        initialize_app(credentials.Certificate(os.getenv("GOOGLE_APPLICATION_CREDENTIALS")))
+
+    # One pooled HTTP/2 connection set to OpenAI for the whole process
+    app.state.openai = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=DefaultAsyncHttpxClient(
+            http2=True, limits=httpx.Limits(max_connections=100)
+        ),
+    )
+    yield
+    await app.state.openai.close()
+
+
+# Create FastAPI app (orjson encodes large /fetch payloads much faster)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Dynamically load allowed origins from .env or Render dashboard
 origins = os.getenv("FRONTEND_URL", "").split(",") + [
@@ -30,10 +52,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-print("ALLOWED ORIGINS:", [o.strip() for o in origins if o.strip()])
-
-# Import your routers
-from routers import data
 app.include_router(data.router)
 
 @app.get("/")
@@ -0,0 +1,234 @@
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+import orjson
+import pandas as pd
+from cachetools import TTLCache
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTEXTS = 128
+MAX_DERIVED = 256
+FRAME_CACHE_DIR = os.getenv(
+    "DATASET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cubinix-datasets")
+)
+# /tmp is often tmpfs and counts against container memory; the least
+# recently used files are removed once the cache grows past this
+FRAME_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+_lock = threading.Lock()
+_contexts = OrderedDict()    # (fingerprint, [format,] limit) -> rendered text
+_rows = TTLCache(maxsize=1024, ttl=60)   # uid -> (fingerprint, rows)
+_derived = OrderedDict()     # (fingerprint, kind, ...) -> computed value
+_MISSING = object()
+
+
+def _dumps(obj):
+    # sorted keys keep the bytes identical for identical rows; numpy scalars
+    # and arrays from frame-derived values serialize natively, not via str()
+    return orjson.dumps(
+        obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY, default=str
+    )
+
+
+def fingerprint(data):
+    return hashlib.blake2b(_dumps(data), digest_size=16).hexdigest()
+
+
+def rows_context(fp, data, limit=None):
+    """
+    Renders the first `limit` rows (all rows if None) as one JSON object per
+    line. The result is memoized per dataset fingerprint, so repeated prompts
+    over the same dataset skip the serialization entirely.
+    """
+    key = (fp, limit)
+    with _lock:
+        if key in _contexts:
+            _contexts.move_to_end(key)
+            return _contexts[key]
+
+    rows = data if limit is None else data[:limit]
+    text = "\n".join(_dumps(row).decode() for row in rows)
+
+    with _lock:
+        _contexts[key] = text
+        while len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)
+    return text
+
+
+def frame_context(fp, df, limit=200):
+    """
+    Renders a CSV sample of the first `limit` rows plus per-column stats.
+    CSV is written by pandas' C writer and costs far fewer tokens than one
+    JSON object per row. Memoized per dataset fingerprint like rows_context.
+    """
+    key = (fp, "csv", limit)
+    with _lock:
+        if key in _contexts:
+            _contexts.move_to_end(key)
+            return _contexts[key]
+
+    sample = df.head(limit).to_csv(index=False)
+    stats = df.describe(include="all").to_csv()
+    text = f"Sample rows ({min(limit, len(df))} of {len(df)}):\n{sample}\nColumn stats:\n{stats}"
+
+    with _lock:
+        _contexts[key] = text
+        while len(_contexts) > MAX_CONTEXTS:
+            _contexts.popitem(last=False)
+    return text
+
+
+def memo(key, compute):
+    """
+    Returns compute() memoized under key. Keys start with the dataset
+    fingerprint, so a new upload never sees values derived from the old one.
+    """
+    with _lock:
+        value = _derived.get(key, _MISSING)
+        if value is not _MISSING:
+            _derived.move_to_end(key)
+            return value
+
+    value = compute()
+
+    with _lock:
+        _derived[key] = value
+        while len(_derived) > MAX_DERIVED:
+            _derived.popitem(last=False)
+    return value
+
+
+# ───────────────────── Row cache ─────────────────────
+def get_rows(uid, fp):
+    """Returns the cached rows if they are still the stored version, else None."""
+    with _lock:
+        entry = _rows.get(uid)
+    if entry is None or entry[0] != fp:
+        return None
+    return entry[1]
+
+
+def put_rows(uid, fp, rows):
+    with _lock:
+        _rows[uid] = (fp, rows)
+
+
+# ───────────────────── Columnar frame cache ─────────────────────
+def _frame_path(uid, fp):
+    return os.path.join(FRAME_CACHE_DIR, f"{uid}-{fp}.feather")
+
+
+def _column_array(values):
+    """
+    Types one column that Arrow could not infer as a whole. Sheets returns
+    "" for blank cells, so blanks become nulls first; a column that is still
+    mixed (e.g. numbers and "N/A") is stored as text.
+    """
+    try:
+        return pa.array(values)
+    except pa.ArrowException:
+        pass
+    values = [None if v == "" else v for v in values]
+    try:
+        return pa.array(values)
+    except pa.ArrowException:
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def _to_table(data):
+    try:
+        if isinstance(data, pd.DataFrame):
+            return pa.Table.from_pandas(data, preserve_index=False)
+        return pa.Table.from_pylist(data)
+    except pa.ArrowException:
+        pass
+    if isinstance(data, pd.DataFrame):
+        columns = {str(c): data[c].tolist() for c in data.columns}
+    else:
+        names = dict.fromkeys(chain.from_iterable(data))
+        columns = {n: [row.get(n) for row in data] for n in names}
+    return pa.table({n: _column_array(v) for n, v in columns.items()})
+
+
+def _evict(keep):
+    """Drops the least recently used cache files beyond FRAME_CACHE_MAX_BYTES."""
+    files = []
+    for path in glob.glob(os.path.join(FRAME_CACHE_DIR, "*.feather")):
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= FRAME_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def write_frame(uid, fp, data):
+    """
+    Stores the dataset (rows or a DataFrame) as an Arrow IPC (Feather) file
+    next to the stored copy, drops any file cached for the user's previous
+    dataset and keeps the whole cache under FRAME_CACHE_MAX_BYTES. Caching
+    is best-effort; write failures are logged and leave the dataset uncached.
+    """
+    path = _frame_path(uid, fp)
+    try:
+        os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+        table = _to_table(data)
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        feather.write_feather(table, tmp)
+        os.replace(tmp, path)   # readers never see a partial file
+    except (OSError, pa.ArrowException) as e:
+        logger.warning("Skipping frame cache for %s: %s", uid, e)
+        return
+    for stale in glob.glob(_frame_path(uid, "*")):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    _evict(keep=path)
+
+
+def read_table(uid, fp, columns=None):
+    """Returns the cached Arrow table for this dataset version, or None."""
+    path = _frame_path(uid, fp)
+    try:
+        table = feather.read_table(path, columns=columns)
+        os.utime(path)   # mtime doubles as the LRU clock for _evict
+    except (OSError, pa.ArrowException):
+        return None
+    return table
+
+
+def read_frame(uid, fp, columns=None):
+    """Returns the cached DataFrame for this dataset version, or None."""
+    table = read_table(uid, fp, columns)
+    return None if table is None else table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def read_columns(uid, fp):
+    """Column names of the cached dataset from the file footer alone, or None."""
+    try:
+        with pa.memory_map(_frame_path(uid, fp)) as source:
+            return pa.ipc.open_file(source).schema.names
+    except (OSError, pa.ArrowException):
+        return None
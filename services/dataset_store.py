@@ -0,0 +1,270 @@
+import asyncio
+import io
+import logging
+import os
+from functools import lru_cache
+from itertools import chain
+
+import orjson
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import firestore_async, storage
+
+from services import dataset_cache
+
+logger = logging.getLogger(__name__)
+
+# Rows are sharded into datasets/{uid}/chunks/{fingerprint}-{i}. Firestore
+# stores every column name again in every row, so shards are cut by
+# serialized size to stay under its 1 MiB document limit, with CHUNK_ROWS as
+# an upper cap. Each upload writes its own shards and only then points the
+# meta at them, so readers never see a half-written mix.
+# A commit request is capped at 10 MiB, so a batch carries only a handful of
+# (up to 1 MiB) chunk documents.
+CHUNK_ROWS = 500
+CHUNK_BYTES = 900_000
+CHUNKS_PER_BATCH = 8
+# BulkWriter retries a failed write with linear backoff up to this many times
+MAX_WRITE_ATTEMPTS = 5
+META_FIELDS = [
+    "fingerprint", "row_count", "chunk_count", "chunk_version", "columns", "blob", "schema",
+]
+
+# When set, datasets are stored as one Parquet object per version in this
+# bucket and Firestore keeps only the pointer, schema and counts
+DATASET_BUCKET = os.getenv("DATASET_BUCKET")
+
+
+@lru_cache(maxsize=1)
+def _db():
+    return firestore_async.client()
+
+
+def _ref(uid):
+    return _db().collection("datasets").document(uid)
+
+
+@lru_cache(maxsize=1)
+def _bucket():
+    return storage.bucket(DATASET_BUCKET)
+
+
+def _chunk_id(meta, i):
+    # shards written before versioning are plain "{i}"
+    version = meta.get("chunk_version")
+    return f"{version}-{i}" if version else str(i)
+
+
+def _blob_prefix(uid):
+    return f"datasets/{uid}/"
+
+
+def _write_parquet(uid, rows, fp):
+    """
+    Uploads the rows as a zstd Parquet object and returns (blob name, schema),
+    or None when Arrow cannot type them (e.g. mixed int/str Sheets columns).
+    """
+    try:
+        table = pa.Table.from_pylist(rows)
+    except pa.ArrowException as e:
+        logger.warning("Storing %s in Firestore chunks: %s", uid, e)
+        return None
+    buf = io.BytesIO()
+    pq.write_table(table, buf, compression="zstd")
+    name = f"{_blob_prefix(uid)}{fp}.parquet"
+    _bucket().blob(name).upload_from_string(
+        buf.getvalue(), content_type="application/vnd.apache.parquet"
+    )
+    schema = [{"name": f.name, "type": str(f.type)} for f in table.schema]
+    return name, schema
+
+
+def _read_parquet(name, columns=None):
+    # BlobReader is seekable, so a column subset only fetches those columns
+    with _bucket().blob(name).open("rb") as f:
+        return pq.read_table(f, columns=columns)
+
+
+def _drop_blobs(uid, keep=None):
+    stale = [b for b in _bucket().list_blobs(prefix=_blob_prefix(uid)) if b.name != keep]
+    if stale:
+        _bucket().delete_blobs(stale)
+
+
+async def load_meta(uid):
+    """Returns the dataset metadata without downloading any rows, or None."""
+    snap = await _ref(uid).get(field_paths=META_FIELDS)
+    if not snap.exists:
+        return None
+    return snap.to_dict() or {}
+
+
+async def load_rows(uid, meta):
+    # The cheap metadata read tells us whether the in-process copy is current
+    fp = meta.get("fingerprint")
+    if fp and (rows := dataset_cache.get_rows(uid, fp)) is not None:
+        return rows
+
+    ref = _ref(uid)
+    if "blob" in meta:
+        table = await run_in_threadpool(_read_parquet, meta["blob"])
+        rows = await run_in_threadpool(table.to_pylist)
+    elif "chunk_count" not in meta:
+        # legacy layout: every row inline in the parent document
+        snap = await ref.get(field_paths=["data"])
+        rows = (snap.to_dict() or {}).get("data", [])
+    else:
+        chunks = ref.collection("chunks")
+        snaps = await asyncio.gather(
+            *(chunks.document(_chunk_id(meta, i)).get() for i in range(meta["chunk_count"]))
+        )
+        rows = []
+        for snap in snaps:
+            rows.extend((snap.to_dict() or {}).get("rows", []))
+
+    if fp:
+        dataset_cache.put_rows(uid, fp, rows)
+    return rows
+
+
+async def load_dataset(uid):
+    """
+    Returns (fingerprint, rows). The fingerprint is None when the user has
+    no dataset document at all.
+    """
+    meta = await load_meta(uid)
+    if meta is None:
+        return None, []
+    rows = await load_rows(uid, meta)
+    fp = meta.get("fingerprint") or await run_in_threadpool(dataset_cache.fingerprint, rows)
+    return fp, rows
+
+
+async def load_df(uid, meta=None, columns=None):
+    """
+    Returns (fingerprint, DataFrame) like load_dataset. With Parquet storage
+    only the requested columns are read; the Firestore layouts download the
+    rows and select the columns afterwards.
+    """
+    meta = meta if meta is not None else await load_meta(uid)
+    if meta is None:
+        return None, pd.DataFrame()
+    if "blob" in meta:
+        table = await run_in_threadpool(_read_parquet, meta["blob"], columns)
+        df = await run_in_threadpool(table.to_pandas, types_mapper=pd.ArrowDtype)
+        return meta["fingerprint"], df
+
+    rows = await load_rows(uid, meta)
+    fp = meta.get("fingerprint") or await run_in_threadpool(dataset_cache.fingerprint, rows)
+    df = await run_in_threadpool(pd.DataFrame, rows)
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    return fp, df
+
+
+def _bulk_write(ops):
+    """
+    Applies (doc_ref, payload-or-None) ops through a BulkWriter, which sends
+    batches in parallel under Firestore's 500/50/5 ramp-up and retries
+    contended writes. It blocks until every write settled, so it runs in the
+    threadpool; failures that outlive the retries are raised.
+    """
+    failures = []
+
+    def on_error(failure, _writer):
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        failures.append(failure)
+        return False
+
+    writer = _db().bulk_writer()
+    writer.batch_size = CHUNKS_PER_BATCH   # default 20 could pass the 10 MiB cap
+    writer.on_write_error(on_error)
+    for doc_ref, payload in ops:
+        if payload is None:
+            writer.delete(doc_ref)
+        else:
+            writer.set(doc_ref, payload)
+    writer.close()
+    if failures:
+        raise RuntimeError(f"{len(failures)} dataset writes failed: {failures[0].message}")
+
+
+def _shards(rows):
+    """Splits rows into shards of at most CHUNK_ROWS rows and ~CHUNK_BYTES."""
+    shards, start, size = [], 0, 0
+    for i, row in enumerate(rows):
+        n = len(orjson.dumps(row, default=str))
+        if i > start and (i - start >= CHUNK_ROWS or size + n > CHUNK_BYTES):
+            shards.append(rows[start:i])
+            start, size = i, 0
+        size += n
+    if start < len(rows):
+        shards.append(rows[start:])
+    return shards
+
+
+def _key_union(rows):
+    # every header in first-seen order
+    return list(dict.fromkeys(chain.from_iterable(rows)))
+
+
+async def save_dataset(uid, rows, fp, columns=None):
+    """
+    Stores a new dataset version. Pass the header as columns when the caller
+    already knows it; otherwise it is collected from the rows.
+    """
+    ref = _ref(uid)
+    chunks = ref.collection("chunks")
+    previous = await load_meta(uid) or {}
+
+    stored = None
+    if DATASET_BUCKET:
+        stored = await run_in_threadpool(_write_parquet, uid, rows, fp)
+    shards = [] if stored else await run_in_threadpool(_shards, rows)
+    chunk_count = len(shards)
+    if columns is None:
+        columns = await run_in_threadpool(_key_union, rows)
+
+    meta = {
+        "fingerprint": fp,
+        "row_count": len(rows),
+        "chunk_count": chunk_count,
+        # kept on the meta so schema checks need no rows
+        "columns": list(columns),
+    }
+    if stored:
+        meta["blob"], meta["schema"] = stored
+    else:
+        meta["chunk_version"] = fp
+
+    # New shards go under their own ids; the previous version stays intact
+    # (and keeps being served) until the meta below points away from it
+    ops = [
+        (chunks.document(_chunk_id(meta, i)), {"rows": shard})
+        for i, shard in enumerate(shards)
+    ]
+    if ops:
+        await run_in_threadpool(_bulk_write, ops)
+
+    # set() without merge also drops the legacy inline "data" field
+    await ref.set(meta)
+    dataset_cache.put_rows(uid, fp, rows)
+
+    # The previous version is unreferenced now; a failed cleanup only leaves
+    # orphaned shards or objects behind
+    try:
+        # re-uploading identical rows rewrote the very same shard ids
+        same_shards = not stored and previous.get("chunk_version") == fp
+        if previous.get("chunk_count") and not same_shards:
+            stale = [
+                (chunks.document(_chunk_id(previous, i)), None)
+                for i in range(previous["chunk_count"])
+            ]
+            await run_in_threadpool(_bulk_write, stale)
+        if DATASET_BUCKET:
+            await run_in_threadpool(_drop_blobs, uid, meta.get("blob"))
+    except Exception as e:
+        logger.warning("Cleanup of previous dataset for %s failed: %s", uid, e)
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # semantic matching is optional; exact matches still work
+    SentenceTransformer = None
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+MAX_DISTANCE = 0.15          # cosine distance under which two questions match
+TTL_SECONDS = 60 * 60
+MAX_ENTRIES_PER_SCOPE = 256
+PRUNE_INTERVAL = 5 * 60      # seconds between sweeps of expired disk rows
+# Exact-match answers also persist here so they survive restarts/redeploys
+DB_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(tempfile.gettempdir(), "cubinix-llm-cache.sqlite3")
+)
+
+_lock = threading.Lock()
+_entries = {}                # (uid, dataset fingerprint, endpoint) -> [entry, ...]
+_last_prune = 0.0
+# Years, amounts, quarters ("q3"), top-N counts: embeddings barely tell
+# these apart, so a semantic hit requires them to be identical
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize(question):
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip("?!. ")
+
+
+@lru_cache(maxsize=1)
+def _conn():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, value BLOB, ts INTEGER)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS answers_ts ON answers (ts)")
+    return conn
+
+
+def _key(uid, data_hash, endpoint, model, q):
+    raw = f"{uid}|{data_hash}|{endpoint}|{model}|{q}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _prune(now):
+    # Expired answers are never read again; sweep them from disk and from
+    # every in-memory scope so neither grows without bound. Caller holds _lock.
+    global _last_prune
+    if now - _last_prune < PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    _conn().execute("DELETE FROM answers WHERE ts <= ?", (int(now - TTL_SECONDS),))
+    for key in list(_entries):
+        live = [e for e in _entries[key] if now - e["ts"] < TTL_SECONDS]
+        if live:
+            _entries[key] = live
+        else:
+            del _entries[key]
+
+
+@lru_cache(maxsize=1)
+def _model():
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+@lru_cache(maxsize=1024)
+def _embed(text):
+    if SentenceTransformer is None:
+        return None
+    return _model().encode(text, normalize_embeddings=True)
+
+
+def get(uid, data_hash, endpoint, question, model):
+    """
+    Returns a cached answer for this user's dataset and endpoint if the
+    question matches a previous one exactly (in memory, then on disk) or,
+    with sentence-transformers, semantically.
+    """
+    q = normalize(question)
+    now = time.time()
+    scope_key = (uid, data_hash, endpoint)
+    with _lock:
+        live = [e for e in _entries.get(scope_key, []) if now - e["ts"] < TTL_SECONDS]
+        if live:
+            _entries[scope_key] = live
+        else:
+            # never keep a key for a scope with nothing cached
+            _entries.pop(scope_key, None)
+
+    for e in live:
+        if e["question"] == q:
+            return e["answer"]
+
+    with _lock:
+        row = _conn().execute(
+            "SELECT value FROM answers WHERE key = ? AND ts > ?",
+            (_key(uid, data_hash, endpoint, model, q), int(now - TTL_SECONDS)),
+        ).fetchone()
+    if row is not None:
+        return row[0].decode()
+    if not live:
+        return None
+
+    vec = _embed(q)
+    numbers = _NUMBER_RE.findall(q)
+    candidates = [e for e in live if e["vec"] is not None and e["numbers"] == numbers]
+    if vec is None or not candidates:
+        return None
+    distances = 1.0 - np.stack([e["vec"] for e in candidates]) @ vec
+    best = int(np.argmin(distances))
+    if distances[best] < MAX_DISTANCE:
+        return candidates[best]["answer"]
+    return None
+
+
+def put(uid, data_hash, endpoint, question, model, answer):
+    q = normalize(question)
+    entry = {
+        "question": q,
+        "vec": _embed(q),
+        "numbers": _NUMBER_RE.findall(q),
+        "answer": answer,
+        "ts": time.time(),
+    }
+    with _lock:
+        _conn().execute(
+            "INSERT OR REPLACE INTO answers (key, value, ts) VALUES (?, ?, ?)",
+            (_key(uid, data_hash, endpoint, model, q), answer.encode(), int(entry["ts"])),
+        )
+        _prune(entry["ts"])
+        # answers for a user's previous dataset can never be hit again
+        for key in [k for k in _entries if k[0] == uid and k[1] != data_hash]:
+            del _entries[key]
+        scope = _entries.setdefault((uid, data_hash, endpoint), [])
+        scope.append(entry)
+        del scope[:-MAX_ENTRIES_PER_SCOPE]
@@ -1,64 +1,210 @@
-from collections import defaultdict
-
-def _parse_money(x):
-    if x is None:
-        return None
-    s = str(x).strip()
-    if not s:
-        return None
-    # remove common formatting
-    s = s.replace("$", "").replace(",", "")
-    try:
-        return float(s)
-    except Exception:
-        return None
-
-def _find_value_by_keywords(record, keywords):
+import re
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import numba
+except ImportError:  # optional; the pandas path below handles every size
+    numba = None
+
+REP_KEYWORDS = ["rep", "sales_rep", "agent", "salesperson", "owner"]
+AMOUNT_KEYWORDS = ["amount", "value", "revenue", "price", "total"]
+
+
+def _keyword_pattern(keywords):
+    return re.compile("|".join(re.escape(kw) for kw in keywords), re.IGNORECASE)
+
+
+# canonical field -> compiled partial-match pattern, built once at import
+_PATTERNS = {
+    "sales_rep": _keyword_pattern(REP_KEYWORDS),
+    "deal_value": _keyword_pattern(AMOUNT_KEYWORDS),
+}
+
+# Below this many rows the JIT kernels are not worth their dispatch overhead
+NUMBA_MIN_ROWS = 100_000
+
+# Both amount parsers drop these characters and then accept only this
+# grammar, so totals do not change when a dataset crosses NUMBA_MIN_ROWS
+MONEY_STRIP_RE = "[$, \t\n\r\v\f\u00a0]"
+MONEY_NUMBER_RE = r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?"
+
+
+def _resolve_column(columns, canonical, keywords):
     """
-    Finds a value in a dict where the key matches any keyword
-    (exact or partial, case-insensitive).
+    Picks the column holding a field: the canonical name first, then an
+    exact keyword match, then a partial match (case-insensitive).
     """
-    lower_keys = {k.lower(): k for k in record.keys()}
+    if canonical in columns:
+        return canonical
+
+    lower_cols = {str(c).lower(): c for c in columns}
 
     # exact match first
     for kw in keywords:
-        if kw.lower() in lower_keys:
-            return record[lower_keys[kw.lower()]]
+        if kw in lower_cols:
+            return lower_cols[kw]
 
-    # partial match next
-    for k in record.keys():
-        kl = k.lower()
-        for kw in keywords:
-            if kw.lower() in kl:
-                return record[k]
-    return None
+    # partial match next, one precompiled alternation per column
+    pattern = _PATTERNS.get(canonical) or _keyword_pattern(keywords)
+    return next((c for c in columns if pattern.search(str(c))), None)
 
-def get_top_sales_reps(records, top_n=5):
-    revenue_by_rep = defaultdict(float)
 
-    for record in records:
-        # 1) Try canonical keys first
-        rep = record.get("sales_rep")
-        amount = record.get("deal_value")
+if numba is not None:
+    @numba.njit(cache=True)
+    def _parse_money_batch(buf, offsets):
+        """
+        Parses each UTF-8 slice buf[offsets[i]:offsets[i + 1]] as a number,
+        ignoring "$", ",", ASCII whitespace and U+00A0 (MONEY_STRIP_RE).
+        Accepts exactly MONEY_NUMBER_RE, so "inf"/"nan" are rejected like in
+        the pandas path. Returns (values, valid_mask).
+        """
+        n = offsets.shape[0] - 1
+        values = np.zeros(n, np.float64)
+        mask = np.zeros(n, np.bool_)
+        for i in range(n):
+            val = 0.0
+            scale = 1.0
+            sign = 1.0
+            exp = 0
+            exp_sign = 1
+            digits = 0
+            seen_sign = False
+            seen_dot = False
+            in_exp = False
+            exp_signed = False
+            exp_digits = 0
+            ok = True
+            skip = False
+            end = offsets[i + 1]
+            for j in range(offsets[i], end):
+                if skip:
+                    skip = False
+                    continue
+                ch = buf[j]
+                if ch == 36 or ch == 44 or ch == 32 or 9 <= ch <= 13:   # $ , space \t\n\v\f\r
+                    continue
+                if ch == 0xC2 and j + 1 < end and buf[j + 1] == 0xA0:   # U+00A0 in UTF-8
+                    skip = True
+                    continue
+                if 48 <= ch <= 57:
+                    if in_exp:
+                        exp = exp * 10 + (ch - 48)
+                        exp_digits += 1
+                    elif seen_dot:
+                        scale /= 10.0
+                        val += (ch - 48) * scale
+                        digits += 1
+                    else:
+                        val = val * 10.0 + (ch - 48)
+                        digits += 1
+                elif (ch == 45 or ch == 43) and not in_exp and not seen_sign and digits == 0 and not seen_dot:
+                    seen_sign = True
+                    if ch == 45:
+                        sign = -1.0
+                elif (ch == 45 or ch == 43) and in_exp and exp_digits == 0 and not exp_signed:
+                    exp_signed = True
+                    if ch == 45:
+                        exp_sign = -1
+                elif ch == 46 and not seen_dot and not in_exp:
+                    seen_dot = True
+                elif (ch == 101 or ch == 69) and digits > 0 and not in_exp:
+                    in_exp = True
+                else:
+                    ok = False
+                    break
+            if ok and digits > 0 and (not in_exp or exp_digits > 0):
+                result = sign * val * 10.0 ** (exp_sign * exp)
+                # an overflowing exponent is invalid in to_numeric too
+                if np.isfinite(result):
+                    values[i] = result
+                    mask[i] = True
+        return values, mask
+
+    @numba.njit(parallel=True)
+    def _sum_by_code(codes, values, mask, n_codes):
+        """Per-code totals and hit counts; each thread owns one partial row."""
+        n = codes.shape[0]
+        n_parts = numba.get_num_threads()
+        step = (n + n_parts - 1) // n_parts
+        sums = np.zeros((n_parts, n_codes), np.float64)
+        hits = np.zeros((n_parts, n_codes), np.int64)
+        for p in numba.prange(n_parts):
+            for i in range(p * step, min(n, (p + 1) * step)):
+                c = codes[i]
+                if c >= 0 and mask[i]:
+                    sums[p, c] += values[i]
+                    hits[p, c] += 1
+        totals = np.zeros(n_codes, np.float64)
+        counts = np.zeros(n_codes, np.int64)
+        for p in range(n_parts):
+            for c in range(n_codes):
+                totals[c] += sums[p, c]
+                counts[c] += hits[p, c]
+        return totals, counts
+
+
+def _top_reps_numba(reps, amounts, top_n):
+    codes, uniques = pd.factorize(reps)
+    # Arrow hands us the column as one contiguous byte buffer + offsets
+    arr = pa.array(amounts.astype(str).tolist(), type=pa.large_string())
+    offsets = np.frombuffer(arr.buffers()[1], dtype=np.int64)[arr.offset:arr.offset + len(arr) + 1]
+    data = arr.buffers()[2]
+    buf = np.frombuffer(data, dtype=np.uint8) if data is not None else np.zeros(0, np.uint8)
+
+    values, mask = _parse_money_batch(buf, offsets)
+    totals, counts = _sum_by_code(codes.astype(np.int64), values, mask, len(uniques))
 
-        # 2) If canonical keys not present, fallback to keyword detection
-        if not rep:
-            rep = _find_value_by_keywords(record, ["rep", "sales_rep", "agent", "salesperson", "owner"])
-        if amount is None or amount == "":
-            amount = _find_value_by_keywords(record, ["amount", "value", "revenue", "price", "total"])
+    order = [i for i in np.argsort(-totals, kind="stable") if counts[i] > 0][:top_n]
+    return [(uniques[i], totals[i]) for i in order]
 
-        if not rep:
-            continue
 
-        parsed = _parse_money(amount)
-        if parsed is None:
-            continue
+def _top_reps_pandas(reps, amounts, top_n):
+    # strip the formatting characters in one Arrow regex kernel, blank out
+    # anything the numba grammar would reject ("inf", "nan", "1e+-5", ...),
+    # then parse the whole column in one pass
+    text = amounts.astype(pd.StringDtype("pyarrow")).str.replace(MONEY_STRIP_RE, "", regex=True)
+    text = text.where(text.str.fullmatch(MONEY_NUMBER_RE, na=False))
+    parsed = pd.to_numeric(text, errors="coerce")
+    valid = reps.notna() & parsed.notna()
+    return list(parsed[valid].groupby(reps[valid], sort=False).sum().nlargest(top_n).items())
+
+
+def resolve_sales_columns(columns):
+    """Returns (rep_col, amount_col); either is None when nothing matches."""
+    return (
+        _resolve_column(columns, "sales_rep", REP_KEYWORDS),
+        _resolve_column(columns, "deal_value", AMOUNT_KEYWORDS),
+    )
+
+
+def get_top_sales_reps(records, top_n=5):
+    """records is a list of row dicts or an already loaded DataFrame."""
+    if isinstance(records, pd.DataFrame):
+        df = records
+        rep_col, amount_col = resolve_sales_columns(df.columns)
+    else:
+        # resolve once over the key union (first-seen order, like DataFrame's
+        # own columns), then build a frame holding just the two needed columns
+        headers = list(dict.fromkeys(chain.from_iterable(records)))
+        rep_col, amount_col = resolve_sales_columns(headers)
+        if rep_col is not None and amount_col is not None:
+            df = pd.DataFrame(records, columns=list(dict.fromkeys([rep_col, amount_col])))
+    if rep_col is None or amount_col is None:
+        return []
 
-        revenue_by_rep[str(rep).strip()] += parsed
+    reps = df[rep_col].astype(str).str.strip()
+    reps = reps.where(df[rep_col].notna() & reps.ne(""))
 
-    ranked = sorted(revenue_by_rep.items(), key=lambda x: x[1], reverse=True)
+    if numba is not None and len(df) >= NUMBA_MIN_ROWS:
+        ranked = _top_reps_numba(reps, df[amount_col], top_n)
+    else:
+        ranked = _top_reps_pandas(reps, df[amount_col], top_n)
 
     return [
-        {"sales_rep": rep, "total_revenue": round(total, 2)}
-        for rep, total in ranked[:top_n]
+        {"sales_rep": rep, "total_revenue": round(float(total), 2)}
+        for rep, total in ranked
     ]